@@ -1,95 +1,215 @@
 import sys
 import requests
-from bs4 import BeautifulSoup, Tag
-from thefuzz import fuzz, process
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer, Tag
+from rapidfuzz import fuzz, process, utils
 import json
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import time
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 import re
 import urllib.parse
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import BrowserContext, TimeoutError as PlaywrightTimeoutError, sync_playwright
+
+# OBA affiliate code -> playoba.ca affiliate id and current season id
+_AFFILIATE_MAP: Mapping[str, Dict[str, str]] = MappingProxyType({
+    "ABA": {"id": "2101", "season_id": "8239"},
+    "COBA": {"id": "2102", "season_id": "8236"},
+    "EOBA": {"id": "2103", "season_id": "8241"},
+    "HDBA": {"id": "2104", "season_id": "8242"},
+    "ICBA": {"id": "2105", "season_id": "8243"},
+    "LDBA": {"id": "2106", "season_id": "8244"},
+    "NBBA": {"id": "2415", "season_id": "8245"},
+    "NCBA": {"id": "2108", "season_id": "8246"},
+    "NCOBA": {"id": "2107", "season_id": "8247"},
+    "NDBA": {"id": "2109", "season_id": "8248"},
+    "SCBA": {"id": "2110", "season_id": "8249"},
+    "SPBA": {"id": "2111", "season_id": "8250"},
+    "TBA": {"id": "2112", "season_id": "8251"},
+    "WCBA": {"id": "2113", "season_id": "8252"},
+    "WOBA": {"id": "2114", "season_id": "8253"},
+    "YSBA": {"id": "2115", "season_id": "8254"},
+})
+
+# Roster pages only need the team name heading and the player links, and
+# team list pages only need the teams grid, so parse nothing else.
+_ROSTER_STRAINER = SoupStrainer(['h1', 'a'])
+# The grids carry extra classes ("teams-grid ng-scope"), and a strainer's
+# class_ string only matches the whole attribute, so match the token.
+_TEAMS_GRID_STRAINER = SoupStrainer('div', class_=re.compile(r'(^|\s)teams-grid(\s|$)'))
+_PLAYER_HREF_RE = re.compile('/player/')
+_TEAM_HREF_RE = re.compile('/team/')
+
+# Elements that show the client-rendered data has arrived. Waiting for these
+# after domcontentloaded is much quicker than waiting for networkidle, which
+# the site's analytics beacons keep pushing back.
+_ROSTER_READY_SELECTOR = 'a[href*="/player/"]'
+_TEAMS_READY_SELECTOR = 'div.teams-grid .team'
+
+# Nothing we extract depends on these, so the browser never downloads them.
+# Stylesheets are still loaded because the data grid relies on them for layout.
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'font', 'media'})
+
+
+def _block_heavy_resources(route):
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def _make_soup(markup: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """Parse HTML with lxml, falling back to html.parser if lxml is missing."""
+    try:
+        return BeautifulSoup(markup, 'lxml', parse_only=parse_only)
+    except FeatureNotFound:
+        return BeautifulSoup(markup, 'html.parser', parse_only=parse_only)
+
 
 class OBARosterScraper:
     def __init__(self):
         self.base_url = "https://www.playoba.ca/stats"
         self.teams_url = "https://www.playoba.ca/stats/teams"
         self.cache_duration_hours = 24
+        self._playwright = None
+        self._browser = None
+        self._context = None
+        # (affiliate_id, season_id) -> all of that affiliate's teams
+        self._affiliate_teams: Dict[Tuple[str, str], Dict[str, str]] = {}
         self.init_database()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down the shared browser, if one was started, and the cache connection."""
+        if self._context is not None:
+            self._context.close()
+        if self._browser is not None:
+            self._browser.close()
+        if self._playwright is not None:
+            self._playwright.stop()
+        self._playwright = self._browser = self._context = None
+        self.conn.close()
+
     def _get_affiliate_info(self, affiliate: str) -> Optional[Dict[str, str]]:
         """Get the OBA affiliate ID and season ID from the affiliate name."""
-        affiliate_map = {
-            "ABA": {"id": "2101", "season_id": "8239"},
-            "COBA": {"id": "2102", "season_id": "8236"},
-            "EOBA": {"id": "2103", "season_id": "8241"},
-            "HDBA": {"id": "2104", "season_id": "8242"},
-            "ICBA": {"id": "2105", "season_id": "8243"},
-            "LDBA": {"id": "2106", "season_id": "8244"},
-            "NBBA": {"id": "2415", "season_id": "8245"},
-            "NCBA": {"id": "2108", "season_id": "8246"},
-            "NCOBA": {"id": "2107", "season_id": "8247"},
-            "NDBA": {"id": "2109", "season_id": "8248"},
-            "SCBA": {"id": "2110", "season_id": "8249"},
-            "SPBA": {"id": "2111", "season_id": "8250"},
-            "TBA": {"id": "2112", "season_id": "8251"},
-            "WCBA": {"id": "2113", "season_id": "8252"},
-            "WOBA": {"id": "2114", "season_id": "8253"},
-            "YSBA": {"id": "2115", "season_id": "8254"},
-        }
-        return affiliate_map.get(affiliate)
+        return _AFFILIATE_MAP.get(affiliate)
     
     def init_database(self):
         """Initialize SQLite database for caching"""
-        self.conn = sqlite3.connect('roster_cache.db')
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('''
+        self.conn = conn = sqlite3.connect('roster_cache.db')
+        # WAL lets readers proceed while another process writes, and
+        # synchronous=NORMAL avoids an fsync on every cache_roster commit
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        # Several scraper processes can be spawned at once by the API;
+        # wait for a competing writer instead of failing with SQLITE_BUSY
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-20000')
+        conn.execute('PRAGMA mmap_size=268435456')
+        conn.execute('''
             CREATE TABLE IF NOT EXISTS roster_cache (
                 team_url TEXT PRIMARY KEY,
                 roster_data TEXT,
-                timestamp DATETIME
+                timestamp INTEGER
             )
         ''')
-        self.conn.commit()
-    
+        # Timestamps are unix epoch seconds; drop rows left over from the old
+        # ISO-string format, which would otherwise compare as always fresh.
+        # user_version records that this one-time cleanup has already run.
+        if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            conn.execute("DELETE FROM roster_cache WHERE typeof(timestamp) != 'integer'")
+            conn.execute('PRAGMA user_version = 1')
+        # Team lists are cached per affiliate and season; division filtering
+        # happens after the lookup.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS affiliate_teams_cache (
+                affiliate_id TEXT,
+                season_id TEXT,
+                teams_data TEXT,
+                timestamp INTEGER,
+                PRIMARY KEY (affiliate_id, season_id)
+            )
+        ''')
+        conn.commit()
+
     def get_cached_roster(self, team_url: str) -> Optional[Dict]:
         """Check if we have a recent cached version of the roster"""
-        self.cursor.execute(
-            'SELECT roster_data, timestamp FROM roster_cache WHERE team_url = ?',
-            (team_url,)
-        )
-        result = self.cursor.fetchone()
-        
+        result = self.conn.execute(
+            'SELECT roster_data FROM roster_cache WHERE team_url = ? AND timestamp > ?',
+            (team_url, int(time.time()) - self.cache_duration_hours * 3600)
+        ).fetchone()
+
         if result:
-            roster_data, timestamp = result
-            cache_time = datetime.fromisoformat(timestamp)
-            if datetime.now() - cache_time < timedelta(hours=self.cache_duration_hours):
-                return json.loads(roster_data)
-        
+            return json.loads(result[0])
+
         return None
     
     def cache_roster(self, team_url: str, roster_data: Dict):
         """Cache the roster data"""
-        self.cursor.execute(
+        self.conn.execute(
             'INSERT OR REPLACE INTO roster_cache (team_url, roster_data, timestamp) VALUES (?, ?, ?)',
-            (team_url, json.dumps(roster_data), datetime.now().isoformat())
+            (team_url, json.dumps(roster_data), int(time.time()))
+        )
+        self.conn.commit()
+
+    def get_cached_affiliate_teams(self, affiliate_id: str, season_id: str) -> Optional[Dict[str, str]]:
+        """Check if we have a recent cached team list for an affiliate's season"""
+        result = self.conn.execute(
+            'SELECT teams_data FROM affiliate_teams_cache '
+            'WHERE affiliate_id = ? AND season_id = ? AND timestamp > ?',
+            (affiliate_id, season_id, int(time.time()) - self.cache_duration_hours * 3600)
+        ).fetchone()
+
+        if result:
+            return json.loads(result[0])
+
+        return None
+
+    def cache_affiliate_teams(self, affiliate_id: str, season_id: str, teams: Dict[str, str]):
+        """Cache an affiliate's team name -> URL mapping for a season"""
+        self.conn.execute(
+            'INSERT OR REPLACE INTO affiliate_teams_cache '
+            '(affiliate_id, season_id, teams_data, timestamp) VALUES (?, ?, ?, ?)',
+            (affiliate_id, season_id, json.dumps(teams), int(time.time()))
         )
         self.conn.commit()
     
 
-    def _get_page_content(self, url: str, wait_for_selector: Optional[str] = None) -> str:
+    def _get_browser_context(self) -> BrowserContext:
+        """Launch the headless browser on first use and reuse it afterwards."""
+        if self._context is None:
+            playwright = sync_playwright().start()
+            try:
+                browser = playwright.chromium.launch()
+                context = browser.new_context()
+                context.route('**/*', _block_heavy_resources)
+            except Exception:
+                # Stop the driver so the next call can start a fresh one
+                playwright.stop()
+                raise
+            self._playwright, self._browser, self._context = playwright, browser, context
+        return self._context
+
+    def _get_page_content(self, url: str, wait_for_selector: str) -> str:
         """Fetches the page content using a headless browser."""
-        with sync_playwright() as p:
-            browser = p.chromium.launch()
-            page = browser.new_page()
+        page = self._get_browser_context().new_page()
+        try:
+            page.goto(url, wait_until='domcontentloaded', timeout=15000)
             try:
-                page.goto(url, wait_until='networkidle', timeout=30000)
-                if wait_for_selector:
-                    page.wait_for_selector(wait_for_selector, timeout=20000)
-                content = page.content()
-            finally:
-                browser.close()
-        return content
+                page.wait_for_selector(wait_for_selector, timeout=20000)
+            except PlaywrightTimeoutError:
+                # e.g. a roster with no players; let the caller's parsing decide
+                pass
+            return page.content()
+        finally:
+            page.close()
 
     def scrape_roster(self, team_url: str) -> Optional[Dict]:
         """Scrape roster data using live web scraping with Playwright."""
@@ -97,45 +217,47 @@ class OBARosterScraper:
         if cached:
             return cached
 
-        try:
-            html_content = self._get_page_content(team_url)
-            soup = BeautifulSoup(html_content, 'html.parser')
+        roster_data = self._scrape_roster_live(team_url)
+        if roster_data and roster_data['players']:
+            self.cache_roster(team_url, roster_data)
 
-            # The playoba.ca site seems to use h1 for the team name.
-            team_name_tag = soup.select_one('h1')
-            team_name = team_name_tag.get_text(strip=True) if team_name_tag else "Unknown Team"
-            
-            players = []
-            # The player data is in a grid, likely using ag-grid.
-            # A common pattern is that player names are in links inside the grid.
-            player_links = soup.select('a[href*="/player/"]')
-            
-            player_names = set() # Use a set to avoid duplicate names
-            for link in player_links:
-                name = link.get_text(strip=True)
-                if name:
-                    player_names.add(name)
-
-            for i, name in enumerate(sorted(list(player_names)), 1):
-                players.append({"number": str(i), "name": name})
-
-            roster_data = {
-                'team_url': team_url,
-                'team_name': team_name,
-                'players': players,
-                'scraped_at': datetime.now().isoformat(),
-                'authentic_data': True,
-                'scrape_method': 'live_web_scraping_playwright'
-            }
-
-            if players:
-                self.cache_roster(team_url, roster_data)
-                
-            return roster_data
+        return roster_data
 
+    def _scrape_roster_live(self, team_url: str) -> Optional[Dict]:
+        """Scrape a roster page without touching the cache."""
+        try:
+            html_content = self._get_page_content(team_url, _ROSTER_READY_SELECTOR)
+            return self._parse_roster(team_url, html_content)
         except Exception as e:
             print(f"Error scraping roster from {team_url}: {e}", file=sys.stderr)
             return None
+
+    def _parse_roster(self, team_url: str, html_content: str) -> Dict:
+        """Extract the team name and players from a rendered roster page."""
+        soup = _make_soup(html_content, parse_only=_ROSTER_STRAINER)
+
+        # The playoba.ca site seems to use h1 for the team name.
+        team_name_tag = soup.find('h1')
+        team_name = team_name_tag.get_text(strip=True) if team_name_tag else "Unknown Team"
+        
+        # The player data is in a grid, likely using ag-grid.
+        # A common pattern is that player names are in links inside the grid.
+        player_links = soup.find_all('a', href=_PLAYER_HREF_RE)
+
+        # Dedup while keeping the order players appear on the page
+        player_names = dict.fromkeys(
+            name for name in (link.get_text(strip=True) for link in player_links) if name
+        )
+        players = [{"number": str(i), "name": name} for i, name in enumerate(player_names, 1)]
+
+        return {
+            'team_url': team_url,
+            'team_name': team_name,
+            'players': players,
+            'scraped_at': datetime.now().isoformat(),
+            'authentic_data': True,
+            'scrape_method': 'live_web_scraping_playwright'
+        }
     
     def get_division_teams(self, affiliate: str, season: str, division: str) -> Dict[str, str]:
         """Get all teams in a division by navigating to the affiliate's team list page."""
@@ -144,30 +266,54 @@ class OBARosterScraper:
             print(f"Unknown affiliate: {affiliate}", file=sys.stderr)
             return {}
 
-        affiliate_id = affiliate_info["id"]
-        season_id = affiliate_info["season_id"]
-        
+        teams = self._get_affiliate_teams(affiliate_info["id"], affiliate_info["season_id"])
+        division_lower = division.lower()
+        return {name: url for name, url in teams.items() if division_lower in name.lower()}
+
+    def _get_affiliate_teams(self, affiliate_id: str, season_id: str) -> Dict[str, str]:
+        """Get every team on an affiliate's team list, from memory, SQLite or the site."""
+        key = (affiliate_id, season_id)
+        if key in self._affiliate_teams:
+            return self._affiliate_teams[key]
+
+        teams = self.get_cached_affiliate_teams(affiliate_id, season_id)
+        if not teams:
+            teams = self._scrape_affiliate_teams(affiliate_id, season_id)
+            if teams:
+                self.cache_affiliate_teams(affiliate_id, season_id, teams)
+
+        if teams:
+            self._affiliate_teams[key] = teams
+        return teams
+
+    def _scrape_affiliate_teams(self, affiliate_id: str, season_id: str) -> Dict[str, str]:
+        """Scrape the team name -> URL mapping from an affiliate's team list page."""
         search_url = f"{self.base_url}#/{affiliate_id}/teams?season_id={season_id}"
 
         try:
-            html_content = self._get_page_content(search_url, wait_for_selector='div.teams-grid')
-            soup = BeautifulSoup(html_content, 'html.parser')
+            html_content = self._get_page_content(search_url, _TEAMS_READY_SELECTOR)
+            soup = _make_soup(html_content, parse_only=_TEAMS_GRID_STRAINER)
             
             teams = {}
-            team_divs = soup.select('div.teams-grid .team')
-            
+            # The page has one grid per division heading
+            team_divs = [
+                team_div
+                for grid in soup.find_all('div', class_='teams-grid')
+                for team_div in grid.find_all(class_='team')
+            ]
+
             for team_div in team_divs:
-                link_tag = team_div.select_one('a[href*="/team/"]')
-                team_name_div = team_div.select_one('.team-name')
+                link_tag = team_div.find('a', href=_TEAM_HREF_RE)
+                team_name_div = team_div.find(class_='team-name')
 
                 if link_tag and team_name_div:
                     href = link_tag.get('href')
                     team_name = team_name_div.get_text(strip=True)
                     
-                    if href and division.lower() in team_name.lower():
+                    if href:
                         full_url = urllib.parse.urljoin(self.base_url, str(href))
                         teams[team_name] = full_url
-            
+
             return teams
 
         except Exception as e:
@@ -184,11 +330,25 @@ class OBARosterScraper:
                 'error': 'Could not retrieve any teams for this division. The website structure might have changed.'
             }
         
-        # Use fuzzy matching to find the best match
+        # Use fuzzy matching to find the best match. WRatio tolerates token
+        # reordering and extra tokens ("13U HS London Tecumsehs" vs
+        # "London Tecumsehs - 13U") that plain ratio scores poorly.
         team_names = list(teams.keys())
-        best_match = process.extractOne(team_name, team_names, scorer=fuzz.ratio)
-        
-        if not best_match or best_match[1] < 60:
+
+        # A case-insensitive exact hit is a perfect match; skip fuzzy scoring
+        exact_name = {name.lower(): name for name in team_names}.get(team_name.strip().lower())
+        if exact_name:
+            best_match = (exact_name, 100)
+        else:
+            best_match = process.extractOne(
+                team_name,
+                team_names,
+                scorer=fuzz.WRatio,
+                processor=utils.default_process,
+                score_cutoff=60
+            )
+
+        if not best_match:
             return {
                 'success': False,
                 'error': 'No matching team found',
@@ -196,7 +356,7 @@ class OBARosterScraper:
             }
         
         matched_name = best_match[0]
-        confidence = best_match[1]
+        confidence = round(best_match[1])
         team_url = teams[matched_name]
         
         return {
@@ -228,35 +388,34 @@ class OBARosterScraper:
 if __name__ == "__main__":
     import sys
     
-    scraper = OBARosterScraper()
-    
-    if len(sys.argv) < 2:
-        print(json.dumps({"success": False, "error": "No command specified. Use 'search' or 'import'"}))
-        sys.exit(1)
+    with OBARosterScraper() as scraper:
+        if len(sys.argv) < 2:
+            print(json.dumps({"success": False, "error": "No command specified. Use 'search' or 'import'"}))
+            sys.exit(1)
     
-    command = sys.argv[1]
+        command = sys.argv[1]
     
-    if command == "search":
-        if len(sys.argv) < 6:
-            print(json.dumps({"success": False, "error": "Usage: search <affiliate> <season> <division> <team_name>"}))
-            sys.exit(1)
+        if command == "search":
+            if len(sys.argv) < 6:
+                print(json.dumps({"success": False, "error": "Usage: search <affiliate> <season> <division> <team_name>"}))
+                sys.exit(1)
         
-        affiliate = sys.argv[2]
-        season = sys.argv[3]
-        division = sys.argv[4]
-        team_name = sys.argv[5]
+            affiliate = sys.argv[2]
+            season = sys.argv[3]
+            division = sys.argv[4]
+            team_name = sys.argv[5]
         
-        result = scraper.get_roster_with_fuzzy_match(affiliate, season, division, team_name)
-        print(json.dumps(result, indent=2))
+            result = scraper.get_roster_with_fuzzy_match(affiliate, season, division, team_name)
+            print(json.dumps(result, indent=2))
 
-    elif command == "import":
-        if len(sys.argv) < 3:
-            print(json.dumps({"success": False, "error": "Usage: import <team_url>"}))
-            sys.exit(1)
+        elif command == "import":
+            if len(sys.argv) < 3:
+                print(json.dumps({"success": False, "error": "Usage: import <team_url>"}))
+                sys.exit(1)
         
-        team_url = sys.argv[2]
-        result = scraper.confirm_and_get_roster(team_url)
-        print(json.dumps(result, indent=2))
+            team_url = sys.argv[2]
+            result = scraper.confirm_and_get_roster(team_url)
+            print(json.dumps(result, indent=2))
     
-    else:
-        print(json.dumps({"success": False, "error": f"Unknown command: {command}. Use 'search' or 'import'"}))
\ No newline at end of file
+        else:
+            print(json.dumps({"success": False, "error": f"Unknown command: {command}. Use 'search' or 'import'"}))
\ No newline at end of file
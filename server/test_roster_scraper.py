@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from roster_scraper import OBARosterScraper
+
+DIVISION_TEAMS_PAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'division_teams_page.html')
+
+
+def test_scrape_affiliate_teams_reads_every_division_grid(tmp_path, monkeypatch):
+    """The saved team list page has one teams-grid per division; all 107 teams must be found"""
+    with open(DIVISION_TEAMS_PAGE, encoding='utf-8') as f:
+        html_content = f.read()
+
+    # Keep the cache database out of the working tree
+    monkeypatch.chdir(tmp_path)
+    with OBARosterScraper() as scraper:
+        monkeypatch.setattr(scraper, '_get_page_content', lambda url, wait_for_selector: html_content)
+        teams = scraper._scrape_affiliate_teams('2111', '8250')
+
+    assert len(teams) == 107
+    assert all(url.startswith('https://www.playoba.ca/') for url in teams.values())